@@ -1,18 +1,83 @@
 # -*- coding:utf-8 -*-
-import logging
-logger = logging.getLogger(__name__)
+# names are exposed lazily (PEP 562), `import katashiro` itself should be cheap.
+from _thread import RLock  # threading is not imported for this
 from .domain import Manager, _Seq, _Domain, _Atom
-from .wrapper import DomainMap
-from .declarative import Translator
-
-
-default_domain_manager = Manager(_Seq, _Domain, _Atom)
-default_translator = Translator(default_domain_manager)
-default_domain_map = DomainMap()
-Domain = default_domain_manager.Domain
-Atom = default_domain_manager.Atom
-Seq = default_domain_manager.Seq
-domain = default_domain_manager.shortcut
-Attribute = default_translator.Attribute
-Sequence = default_translator.Seq
-DomainMeta = default_translator.DomainMeta
+del domain  # submodule. `domain` is default_domain_manager.shortcut
+
+__all__ = [
+    "logger", "Manager", "DomainMap", "Translator",
+    "default_domain_manager", "default_translator", "default_domain_map",
+    "Domain", "Atom", "Seq", "domain", "Attribute", "Sequence", "DomainMeta",
+]
+_lock = RLock()
+
+
+def _logger():
+    import logging
+    return logging.getLogger(__name__)
+
+
+def _default_domain_manager():
+    return Manager(_Seq, _Domain, _Atom)
+
+
+def _default_translator():
+    from .declarative import Translator
+    return Translator(_get("default_domain_manager"))
+
+
+def _default_domain_map():
+    from .wrapper import DomainMap
+    return DomainMap()
+
+
+def _from(module, name):
+    def factory():
+        from importlib import import_module
+        return getattr(import_module(module, __name__), name)
+    return factory
+
+
+def _attr(owner, name):
+    def factory():
+        return getattr(_get(owner), name)
+    return factory
+
+
+_factories = {
+    "logger": _logger,
+    "DomainMap": _from(".wrapper", "DomainMap"),
+    "Translator": _from(".declarative", "Translator"),
+    "default_domain_manager": _default_domain_manager,
+    "default_translator": _default_translator,
+    "default_domain_map": _default_domain_map,
+    "Domain": _attr("default_domain_manager", "Domain"),
+    "Atom": _attr("default_domain_manager", "Atom"),
+    "Seq": _attr("default_domain_manager", "Seq"),
+    "domain": _attr("default_domain_manager", "shortcut"),
+    "Attribute": _attr("default_translator", "Attribute"),
+    "Sequence": _attr("default_translator", "Seq"),
+    "DomainMeta": _attr("default_translator", "DomainMeta"),
+}
+
+
+def _get(name):
+    try:
+        return globals()[name]
+    except KeyError:
+        return __getattr__(name)
+
+
+def __getattr__(name):
+    if name not in _factories:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    with _lock:
+        try:
+            return globals()[name]
+        except KeyError:
+            value = globals()[name] = _factories[name]()
+            return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_factories))
@@ -36,13 +36,17 @@ class _Alias(object):
 
     @reify
     def domain(self):
-        domain = self.translator.domains[self.domain_name]
+        # a view of the referenced domain, rebuilt when it is changed
+        target = self.translator.domains[self.domain_name]
+        return self.translator.manager.derive(lambda: self._build(target), [target])
+
+    def _build(self, target):
+        manager = self.translator.manager
         if not self.is_seq:
-            return self.translator.manager.Domain(self.name, *domain.decompose())
+            return manager.Domain(self.name, *target.decompose())
         else:
-            domain = self.translator.manager.Domain(self.domain_name, *domain.decompose())
-            seq = self.translator.manager.Seq(self.name, [domain], metadata=self.metadata)
-            return seq
+            domain = manager.Domain(self.domain_name, *target.decompose())
+            return manager.Seq(self.name, [domain], metadata=self.metadata)
 
     def _swap(self):
         return self.domain
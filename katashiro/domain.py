@@ -1,4 +1,7 @@
 # -*- coding:utf-8 -*-
+import weakref
+from functools import partial
+from types import CodeType, FunctionType, ModuleType
 from katashiro.exceptions import Conflict
 from katashiro.langhelpers import reify
 
@@ -12,6 +15,10 @@ class Manager(object):
         self.atom_factory = atom_factory
 
     def compose(self, x, y):
+        check = lambda: self.check_fields_conflict(x.fields, y.fields, x, y)  # NOQA
+        return self.derive(lambda: self._compose(x, y), [x, y], check=check)
+
+    def _compose(self, x, y):
         x_fields, x_metadata = x.decompose()
         y_fields, y_metadata = y.decompose()
         self.check_fields_conflict(x_fields, y_fields, x, y)
@@ -73,32 +80,247 @@ class Manager(object):
 
     def include(self, domain, predicate, deep=True):
         if deep:
-            return self._include_deep(domain, predicate)
+            return self.derive(lambda: self._include_deep(domain, predicate), [domain], deep=True)
         else:
-            return self._include_shallow(domain, predicate)
+            return self.derive(lambda: self._include_shallow(domain, predicate), [domain])
 
     def exclude(self, domain, predicate, deep=True):
         return self.include(domain, lambda d: not(predicate(d)), deep=deep)
 
     def rename(self, domain, names):
+        return self.derive(lambda: self._rename(domain, names), [domain], deep=True)
+
+    def _rename(self, domain, names):
         if self.is_atom(domain):
             if domain.id in names:
                 return self.Atom(names[domain.id], domain.metadata.copy())
             else:
                 return domain
         else:
-            fields = [self.rename(f, names) for f in domain.fields]
+            fields = [self._rename(f, names) for f in domain.fields]
             metadata = domain.metadata.copy()
             return self.Domain(names.get(domain.id, domain.id), fields, metadata)
 
+    def derive(self, build, bases, deep=False, check=None):
+        """build a view of bases, rebuilt lazily when one of them is changed.
+
+        check is called when a base is changed, and raises Conflict if the view cannot be rebuilt.
+        """
+        domain = build()
+        if domain is None or self.is_atom(domain):
+            return domain
+        domain.__dict__["_recipe"] = build
+        if check is not None:
+            domain.__dict__["_check"] = check
+        for base in bases:
+            self._watch(base, domain, deep, set())
+        return domain
+
+    def _watch(self, base, domain, deep, seen):
+        if self.is_alias(base) or self.is_atom(base) or id(base) in seen:
+            return
+        seen.add(id(base))
+        base.__dict__.setdefault("_derived", weakref.WeakSet()).add(domain)
+        if deep:
+            for f in base.fields:
+                self._watch(f, domain, deep, seen)
+
+    def touch(self, domain):
+        """notify that domain is changed. derived domains are marked as stale.
+
+        raises Conflict if some derived domain cannot be rebuilt.
+        """
+        d = domain.__dict__
+        d.pop("field_dict", None)
+        d.pop("_finished", None)
+        self._forget_fingerprint(domain, set())
+        for x in list(d.get("_derived", ())):
+            xd = x.__dict__
+            if "_stale" not in xd:
+                xd["_stale"] = True
+                self.touch(x)
+            if "_edits" in xd:
+                self.refresh(x)
+            elif "_check" in xd:
+                xd["_check"]()
+
+    def refresh(self, domain):
+        if "_stale" in domain.__dict__:
+            self.rebuild(domain)
+        return domain
+
+    def rebuild(self, domain):
+        d = domain.__dict__
+        new = d["_recipe"]()
+        # edits to the view itself (via _add_field, _add_metadata) are replayed
+        edits = d.get("_edits", ())
+        ids = set(f.id for f in new._fields)
+        for edit in edits:
+            if edit[0] == "field":
+                if edit[1].id in ids:
+                    raise Conflict("{} of {} (added to both the view and its base)".format(edit[1].id, new.id))
+                ids.add(edit[1].id)
+        for edit in edits:
+            if edit[0] == "field":
+                self._insert_field(new._fields, edit[1])
+            else:
+                new._metadata[edit[1]] = edit[2]
+        del d["_stale"]
+        olds = self._descendants(domain, {})
+        d["id"] = new.id
+        d["_fields"] = new._fields
+        d["_metadata"] = new._metadata
+        d.pop("field_dict", None)
+        d.pop("_finished", None)
+        # DomainMap entries pointing to discarded sub domains are reconstructed by Lookup
+        news = self._descendants(domain, {})
+        for k, f in olds.items():
+            if k not in news:
+                f.__dict__["_retired"] = True
+
+    def _descendants(self, domain, found):
+        for f in domain._fields:
+            if id(f) not in found:
+                found[id(f)] = f
+                if not self.is_alias(f) and not self.is_atom(f):
+                    self._descendants(f, found)
+        return found
+
+    def fetch_plan(self, domain):
+        from katashiro.plan import fetch_plan
+        return fetch_plan(domain)
+
+    def fingerprint(self, domain):
+        """structural hash of domain (hex digest), stable across processes.
+
+        cached until the domain or one of its descendants is changed via manager (e.g. _add_field).
+        aliases are expanded (cycles are hashed as back references), and follow changes of the referenced domain.
+        callables in metadata are hashed by name (or by code, for lambdas and local functions);
+        other callables must have a __fingerprint__ attribute.
+        """
+        return self._fingerprint(domain, [])[0]
+
+    def same(self, x, y):
+        return x is y or self.fingerprint(x) == self.fingerprint(y)
+
+    def _forget_fingerprint(self, node, seen):
+        if id(node) in seen:
+            return
+        seen.add(id(node))
+        node.__dict__.pop("_fingerprint", None)
+        for parent in list(node.__dict__.get("_parents", ())):
+            self._forget_fingerprint(parent, seen)
+
+    def _fingerprint(self, node, stack):
+        for i, x in enumerate(reversed(stack)):
+            if x is node:
+                return "^{}".format(i), True
+        cached = node.__dict__.get("_fingerprint")
+        if cached is not None:
+            return cached, False
+
+        cyclic = False
+        if self.is_alias(node):
+            # the view of the referenced domain. it is touched when the referenced domain is changed
+            target = node._swap()
+            target.__dict__.setdefault("_parents", weakref.WeakSet()).add(node)
+            return self._fingerprint(target, stack)
+        elif self.is_atom(node):
+            parts = ["atom", node.id, self._canonical(node.metadata)]
+        else:
+            stack.append(node)
+            digests = []
+            for f in node.fields:
+                # parents are registered, for invalidation
+                f.__dict__.setdefault("_parents", weakref.WeakSet()).add(node)
+                digest, child_cyclic = self._fingerprint(f, stack)
+                digests.append(digest)
+                cyclic = cyclic or child_cyclic
+            stack.pop()
+            if not isinstance(node.fields, (list, tuple)):
+                digests.sort()
+            tag = "seq" if self.is_seq(node) else "domain"
+            parts = [tag, node.id, self._canonical(node.metadata), digests]
+
+        from hashlib import sha1
+        digest = sha1(repr(parts).encode("utf-8")).hexdigest()
+        if not cyclic:
+            node.__dict__["_fingerprint"] = digest
+        return digest, cyclic
+
+    def _canonical(self, value, seen=()):
+        if isinstance(value, dict):
+            items = sorted((self._canonical(k, seen), self._canonical(v, seen)) for k, v in value.items())
+            return "{{{}}}".format(", ".join("{}: {}".format(k, v) for k, v in items))
+        elif isinstance(value, (list, tuple)):
+            return "[{}]".format(", ".join(self._canonical(v, seen) for v in value))
+        elif isinstance(value, (set, frozenset)):
+            return "{{{}}}".format(", ".join(sorted(self._canonical(v, seen) for v in value)))
+        elif self.is_domain(value):
+            return self.fingerprint(value)
+        elif hasattr(value, "__fingerprint__"):
+            return "fingerprint({})".format(value.__fingerprint__)
+        elif isinstance(value, FunctionType):
+            return self._canonical_function(value, seen)
+        elif isinstance(value, partial):
+            parts = [value.func, value.args, value.keywords]
+            return "partial({})".format(self._canonical(parts, seen))
+        elif callable(value) and "<" not in getattr(value, "__qualname__", "<"):
+            # builtins, classes
+            name = "{}.{}".format(getattr(value, "__module__", None), value.__qualname__)
+            owner = getattr(value, "__self__", None)
+            if owner is None or isinstance(owner, (ModuleType, type)):
+                return name
+            return "{}@{}".format(name, self._canonical(owner, seen))
+        elif value.__class__.__repr__ is object.__repr__ or callable(value):
+            # repr() includes id(), so it is different in each process
+            raise TypeError("cannot fingerprint {!r}, please define __fingerprint__".format(value))
+        else:
+            return repr(value)
+
+    def _canonical_function(self, fn, seen):
+        name = "{}.{}".format(fn.__module__, fn.__qualname__)
+        if "<" not in fn.__qualname__:
+            return name
+        # lambdas and local functions have the same name, so their code and closure are used
+        if fn in seen:
+            return "recursive({})".format(name)
+        seen = seen + (fn, )
+        cells = [c.cell_contents for c in (fn.__closure__ or ())]
+        parts = [self._canonical_code(fn.__code__), fn.__defaults__, fn.__kwdefaults__, cells]
+        return "{}({})".format(name, self._canonical(parts, seen))
+
+    def _canonical_code(self, code):
+        consts = [self._canonical_code(c) if isinstance(c, CodeType) else self._canonical(c) for c in code.co_consts]
+        return "code({}, {}, [{}])".format(code.co_code.hex(), ",".join(code.co_names), ", ".join(consts))
+
     def _extend_fields(self, fields0, fields1):
         fields0.extend(fields1)
 
+    def _insert_field(self, fields, field):
+        fields.append(field)
+
+    def _remove_field(self, fields, field):
+        fields.remove(field)
+
     def _add_field(self, domain, field):
-        domain.fields.append(field)
+        self._insert_field(domain.fields, field)
+        try:
+            self.touch(domain)
+        except Conflict:
+            self._remove_field(domain.fields, field)
+            self.touch(domain)
+            raise
+        self._record_edit(domain, ("field", field))
 
     def _add_metadata(self, domain, k, v):
         domain.metadata[k] = v
+        self.touch(domain)
+        self._record_edit(domain, ("metadata", k, v))
+
+    def _record_edit(self, domain, edit):
+        if "_recipe" in domain.__dict__:
+            domain.__dict__.setdefault("_edits", []).append(edit)
 
     def is_seq_metadata(self, metadata):
         return metadata and metadata.get("datatype") == "seq"  # xxx:
@@ -114,6 +336,9 @@ class Manager(object):
     def is_atom(self, child):
         return not hasattr(child, "fields")
 
+    def is_alias(self, child):
+        return hasattr(child.__class__, "_swap")
+
     def is_domain(self, child):
         return hasattr(child, "decompose")
 
@@ -149,6 +374,26 @@ class _Domain(object):
         self.fields = fields or manager.fields_factory()
         self.metadata = metadata or {}
 
+    @property
+    def fields(self):
+        if "_stale" in self.__dict__:
+            self.manager.rebuild(self)
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields):
+        self._fields = fields
+
+    @property
+    def metadata(self):
+        if "_stale" in self.__dict__:
+            self.manager.rebuild(self)
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
     def decompose(self):
         return self.fields.copy(), self.metadata.copy()
 
@@ -289,6 +534,9 @@ class Symbol:
     datatype = "datatype"
     serialize = "serialize"
     deserialize = "deserialize"
+    batch_loader = "batch_loader"
+    memoize = "memoize"  # True or maxsize
+    column = "column"
 
 
 class Type:
@@ -300,8 +548,11 @@ class Type:
 class SetManager(Manager):
     fields_factory = set
 
-    def _add_field(self, domain, field):
-        domain.fields.add(field)
+    def _insert_field(self, fields, field):
+        fields.add(field)
+
+    def _remove_field(self, fields, field):
+        fields.discard(field)
 
     def _extend_fields(self, fields0, fields1):
         fields0.update(fields1)
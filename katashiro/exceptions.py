@@ -1,3 +1,7 @@
 # -*- coding:utf-8 -*-
 class Conflict(Exception):
     pass
+
+
+class BudgetExceeded(Exception):
+    pass
@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+import gc
+import subprocess
+import sys
+import tracemalloc
+from katashiro.exceptions import BudgetExceeded
+
+
+class Footprint(object):
+    def __init__(self, name, records, size, objects, blocks):
+        self.name = name
+        self.records = records
+        self.size = size
+        self.objects = objects  # gc tracked objects (instances, containers)
+        self.blocks = blocks  # memory blocks (tracemalloc)
+
+    @property
+    def size_per_record(self):
+        return self.size / (self.records or 1)
+
+    @property
+    def objects_per_record(self):
+        return self.objects / (self.records or 1)
+
+    def check(self, budget):
+        """budget is retained bytes per record"""
+        if self.size_per_record > budget:
+            fmt = "{}: {:.1f} bytes/record (budget={} bytes/record)"
+            raise BudgetExceeded(fmt.format(self.name, self.size_per_record, budget))
+        return self
+
+    def __repr__(self):
+        fmt = "<{} name={}, records={}, size={}, objects={}, blocks={}, per_record={:.1f}B/{:.1f}objs>"
+        return fmt.format(self.__class__.__name__, self.name, self.records, self.size, self.objects, self.blocks,
+                          self.size_per_record, self.objects_per_record)
+
+
+def measure(name, records, fn, *args, **kwargs):
+    """measure bytes, objects and memory blocks retained by the return value of fn"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        gc.collect()
+        before = _snapshot()
+        objects = len(gc.get_objects())
+        result = fn(*args, **kwargs)
+        gc.collect()
+        objects = len(gc.get_objects()) - objects
+        after = _snapshot()
+        stats = after.compare_to(before, "filename")
+        size = sum(s.size_diff for s in stats)
+        blocks = sum(s.count_diff for s in stats)
+        del result
+        return Footprint(name, records, size, objects, blocks)
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+# scenarios
+class Record(object):
+    def __init__(self, name, age, tel):
+        self.name = name
+        self.age = age
+        self.tel = tel
+
+
+class Records(object):
+    def __init__(self, records):
+        self.records = records
+
+
+def shortcut_domains(n):
+    from katashiro.domain import Manager, _Seq, _Domain, _Atom
+    manager = Manager(_Seq, _Domain, _Atom)
+
+    def build():
+        return [manager.shortcut("person{}".format(i), ["name", "age", ("address", ["tel", "zip"])])
+                for i in range(n)]
+    return measure("shortcut_domains", n, build)
+
+
+def declared_domains(n):
+    from katashiro.domain import Manager, _Seq, _Domain, _Atom
+    from katashiro.declarative import Translator
+    translator = Translator(Manager(_Seq, _Domain, _Atom))
+
+    def build():
+        domains = []
+        for i in range(n):
+            attrs = {"name": translator.Attribute(), "age": translator.Attribute(datatype="int")}
+            domains.append(translator.DomainMeta("Person{}".format(i), (), attrs))
+        return domains
+    return measure("declared_domains", n, build)
+
+
+def wrapped_sequence(n):
+    from katashiro.domain import Manager, _Seq, _Domain, _Atom
+    from katashiro.wrapper import DomainMap
+    manager = Manager(_Seq, _Domain, _Atom)
+    domain = manager.shortcut("root", [("records", [("record", ["name", "age", "tel"])], {"datatype": "seq"})])
+    ob = Records([Record("name{}".format(i), i, "000-{}".format(i)) for i in range(n)])
+
+    def wrap():
+        wrapper = DomainMap().lookup()(ob, domain)
+        for record in wrapper.records:
+            record.name, record.age, record.tel
+        return wrapper
+    return measure("wrapped_sequence", n, wrap)
+
+
+def import_time(statement="import katashiro", repeat=5):
+    """wall-clock time of statement in a fresh interpreter (seconds, best of repeat)"""
+    return import_times([statement], repeat=repeat)[0]
+
+
+def import_times(statements, repeat=5):
+    """same as import_time, but interleaved. a burst of load on the machine hits all statements alike"""
+    codes = ["import time; t = time.perf_counter(); {}; print(time.perf_counter() - t)".format(s) for s in statements]
+    best = [None] * len(codes)
+    for _ in range(repeat):
+        for i, code in enumerate(codes):
+            p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+            seconds = float(p.stdout)
+            best[i] = seconds if best[i] is None else min(best[i], seconds)
+    return best
+
+
+def imported_modules(statement="import katashiro"):
+    code = "import sys; {}; print(' '.join(sorted(sys.modules)))".format(statement)
+    p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return p.stdout.split()
+
+
+# modules must not be imported by `import katashiro`
+deferred_modules = ["logging", "katashiro.wrapper", "katashiro.lazylist", "katashiro.declarative"]
+# `import katashiro` must be cheaper than import_ratio * (importing and touching all exported names).
+# compared relatively, not by wall-clock, for stable results on slow machines.
+# typically around 0.4; the rest is headroom for noisy CI
+import_ratio = 0.75
+eager_import = "import katashiro; [getattr(katashiro, name) for name in katashiro.__all__]"
+
+
+def check_import(ratio=None, deferred=None):
+    ratio = ratio or import_ratio
+    deferred = deferred or deferred_modules
+    modules = set(imported_modules())
+    eager = [m for m in deferred if m in modules]
+    if eager:
+        raise BudgetExceeded("eagerly imported: {}".format(", ".join(eager)))
+    lazy_seconds, eager_seconds = import_times(["import katashiro", eager_import], repeat=7)
+    if lazy_seconds > eager_seconds * ratio:
+        fmt = "import katashiro: {:.1f}ms, {:.1f}ms with all names (ratio={})"
+        raise BudgetExceeded(fmt.format(lazy_seconds * 1000, eager_seconds * 1000, ratio))
+    return lazy_seconds, eager_seconds
+
+
+def record_batch(n):
+    from katashiro.domain import Manager, _Seq, _Domain, _Atom
+    from katashiro.wrapper import DomainMap
+    manager = Manager(_Seq, _Domain, _Atom)
+    domain = manager.Seq("records", [manager.Domain("record", [
+        manager.Atom("name"), manager.Atom("age", {"datatype": "int"}), manager.Atom("tel")
+    ])])
+    obs = [Record("name{}".format(i), i, "000-{}".format(i)) for i in range(n)]
+
+    def wrap():
+        batch = DomainMap().lookup().batch(obs, domain)
+        for record in batch:
+            record.name, record.age, record.tel
+        return batch
+    return measure("record_batch", n, wrap)
+
+
+# retained bytes per record
+default_budgets = {
+    shortcut_domains: 2048,
+    declared_domains: 1280,
+    wrapped_sequence: 1024,
+    record_batch: 64,
+}
+
+
+def run(n=10000, budgets=None, report=None):
+    """measure all scenarios, raising BudgetExceeded if some of them are over budget"""
+    budgets = budgets or default_budgets
+    footprints = []
+    errors = []
+    for scenario, budget in budgets.items():
+        footprint = scenario(n)
+        if report is not None:
+            report(footprint)
+        try:
+            footprint.check(budget)
+        except BudgetExceeded as e:
+            errors.append(str(e))
+        footprints.append(footprint)
+    if errors:
+        raise BudgetExceeded("; ".join(errors))
+    return footprints
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    failed = False
+    try:
+        run(n, report=print)
+    except BudgetExceeded as e:
+        print("NG: {}".format(e))
+        failed = True
+    try:
+        print("import katashiro: {:.1f}ms ({:.1f}ms with all names)".format(*[t * 1000 for t in check_import()]))
+    except BudgetExceeded as e:
+        print("NG: {}".format(e))
+        failed = True
+    sys.exit(1 if failed else 0)
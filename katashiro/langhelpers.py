@@ -15,3 +15,83 @@ class reify(object):
         val = self.wrapped(inst)
         setattr(inst, self.wrapped.__name__, val)
         return val
+
+
+def _time_key(value):
+    # aware values equal to each other can be in different timezones (12:00 UTC == 21:00 JST)
+    return (value, value.utcoffset(), value.tzname(), value.fold)
+
+
+def _memo_keys():
+    from datetime import date, datetime, time
+    from decimal import Decimal
+    identity = lambda value: value  # NOQA
+    return {
+        str: identity,
+        bytes: identity,
+        int: identity,
+        bool: identity,
+        type(None): identity,
+        float: repr,  # -0.0 == 0.0
+        Decimal: lambda value: value.as_tuple(),  # Decimal("1.00") == Decimal("1.0")
+        date: identity,
+        datetime: _time_key,
+        time: _time_key,
+    }
+
+
+class lru_memo(object):
+    """bounded LRU memo of a one-argument function, keyed by value (and its type).
+
+    equal values are not always printed alike, so only the types in `keys` are memoized,
+    with keys telling such values apart. the other values are passed to the function as is.
+    wrapped can be omitted, passing the function to call() instead (not to keep a reference).
+    """
+    keys = None  # type -> function returning the key
+    def __init__(self, wrapped=None, maxsize=128):
+        from collections import OrderedDict
+        from threading import Lock
+        self.wrapped = wrapped
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = Lock()
+        self.hits = self.misses = 0
+
+    def __call__(self, value):
+        return self.call(self.wrapped, value)
+
+    def key(self, value):
+        keys = self.keys
+        if keys is None:  # datetime and decimal are not imported by `import katashiro`
+            keys = lru_memo.keys = _memo_keys()
+        key = keys.get(value.__class__)  # exact types only, subclasses may print differently
+        if key is None:
+            return None
+        return (value.__class__, key(value))
+
+    def call(self, fn, value):
+        k = self.key(value)
+        if k is None:
+            return fn(value)
+        with self.lock:
+            try:
+                result = self.cache[k]
+                self.cache.move_to_end(k)
+                self.hits += 1
+                return result
+            except KeyError:
+                self.misses += 1
+        result = fn(value)
+        with self.lock:
+            self.cache[k] = result
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return result
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.cache), "maxsize": self.maxsize}
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+            self.hits = self.misses = 0
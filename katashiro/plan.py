@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*-
+from katashiro.domain import S
+
+
+class FetchPlan(object):
+    """attributes touched by a domain, per nesting level
+
+    columns are what the domain reads, only. join keys (primary keys, foreign keys) are not
+    known to domains, so the plans of relations and sequences do not include them.
+    pass them to select() as keys.
+    """
+    def __init__(self, id, truncated=False):
+        self.id = id
+        self.attributes = []
+        self.columns = []
+        self.relations = {}  # one to one, many to one
+        self.sequences = {}  # one to many (eager loading)
+        self.truncated = truncated  # recursive alias, not expanded
+
+    def select(self, table, keys=()):
+        columns = list(keys)
+        columns.extend(c for c in self.columns if c not in columns)
+        if not columns:
+            raise ValueError("{!r}: nothing to select from {!r}, pass keys".format(self, table))
+        return "SELECT {} FROM {}".format(", ".join(quote(c) for c in columns), quote(table))
+
+    def eager_loads(self, prefix=""):
+        r = []
+        for name, plan in self.relations.items():
+            r.extend(plan.eager_loads("{}{}.".format(prefix, name)))
+        for name, plan in self.sequences.items():
+            r.append(prefix + name)
+            r.extend(plan.eager_loads("{}{}.".format(prefix, name)))
+        return r
+
+    def to_dict(self):
+        d = {"attributes": list(self.attributes), "columns": list(self.columns)}
+        if self.relations:
+            d["relations"] = {k: v.to_dict() for k, v in self.relations.items()}
+        if self.sequences:
+            d["sequences"] = {k: v.to_dict() for k, v in self.sequences.items()}
+        if self.truncated:
+            d["truncated"] = True
+        return d
+
+    def __repr__(self):
+        fmt = '<{} id={}, columns={!r}, relations={!r}, sequences={!r} at {}>'
+        return fmt.format(self.__class__.__name__,
+                          self.id,
+                          self.columns,
+                          list(self.relations),
+                          list(self.sequences),
+                          hex(id(self)))
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def fetch_plan(domain):
+    manager = domain.manager
+    if manager.is_seq(domain):
+        plan = _walk(manager, domain.child_domain, [domain.child_domain.id])
+        plan.id = domain.id
+        return plan
+    return _walk(manager, domain, [domain.id])
+
+
+def _walk(manager, domain, names):
+    plan = FetchPlan(domain.id)
+    if manager.is_atom(domain):  # seq of atoms, a value per row
+        _add_column(plan, domain)
+        return plan
+    for f in domain.fields:
+        subnames = names
+        if manager.is_alias(f):
+            if f.domain_name in names:
+                subplans = plan.sequences if f.is_seq else plan.relations
+                subplans[f.id] = FetchPlan(f.id, truncated=True)
+                continue
+            subnames = names + [f.domain_name]
+            f = f._swap()
+
+        if manager.is_atom(f):
+            _add_column(plan, f)
+        elif manager.is_seq(f):
+            subplan = _walk(manager, f.child_domain, subnames)
+            subplan.id = f.id
+            plan.sequences[f.id] = subplan
+        else:
+            plan.relations[f.id] = _walk(manager, f, subnames)
+    return plan
+
+
+def _add_column(plan, atom):
+    plan.attributes.append(atom.id)
+    plan.columns.append(atom.metadata.get(S.column) or atom.id)
+
+
+if __name__ == "__main__":
+    import sqlite3
+    from katashiro import DomainMeta, Attribute, Sequence
+
+    class Pet(metaclass=DomainMeta):
+        name = Attribute()
+        kind = Attribute(column="species")
+
+    class Person(metaclass=DomainMeta):
+        name = Attribute()
+        age = Attribute()
+        birth = Attribute()
+        pets = Sequence(Pet)
+
+    class User(metaclass=DomainMeta):
+        name = Attribute()
+        following = Sequence("User")
+
+    view = Person.cut(["birth"])
+    plan = fetch_plan(view)
+    print(plan.to_dict())
+    print(plan.eager_loads())
+    print(fetch_plan(User).to_dict())
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table people (name text, age integer, birth text)")
+    conn.execute("insert into people values ('foo', 20, '2000-01-01')")
+    print(plan.select("people"))
+    print(conn.execute(plan.select("people")).fetchall())
+
+    conn.execute("create table pets (id integer, owner text, name text, species text)")
+    conn.execute("insert into pets values (1, 'foo', 'tama', 'cat')")
+    print(plan.sequences["pets"].select("pets", keys=["id", "owner"]))
+    print(conn.execute(plan.sequences["pets"].select("pets", keys=["id", "owner"])).fetchall())
@@ -0,0 +1,131 @@
+# -*- coding:utf-8 -*-
+import gc
+import unittest
+
+
+class DerivedDomainTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        self.manager = Manager(_Seq, _Domain, _Atom)
+
+    def _makePerson(self):
+        return self.manager.shortcut("person", ["name", "age", "birth"])
+
+    def test_rebuilt_on_base_change(self):
+        person = self._makePerson()
+        view = person.cut(["birth"])
+        self.manager._add_field(person, self.manager.Atom("email"))
+        self.assertEqual(view.declared, ["name", "age", "email"])
+
+    def test_dead_views_are_not_kept(self):
+        person = self._makePerson()
+        for _ in range(100):
+            person.cut(["birth"])
+        gc.collect()
+        self.assertEqual(len(person._derived), 0)
+
+    def test_local_edits_are_kept(self):
+        person = self._makePerson()
+        view = person.cut(["birth"])
+        self.manager._add_field(view, self.manager.Atom("extra"))
+        self.manager._add_field(person, self.manager.Atom("email"))
+        self.assertEqual(view.declared, ["name", "age", "email", "extra"])
+
+    def test_local_edits__conflict(self):
+        from katashiro.exceptions import Conflict
+        person = self._makePerson()
+        view = person.cut(["birth"])
+        self.manager._add_field(view, self.manager.Atom("extra"))
+        with self.assertRaises(Conflict):
+            self.manager._add_field(person, self.manager.Atom("extra"))
+        self.assertEqual(person.declared, ["name", "age", "birth"])
+        self.assertEqual(view.declared, ["name", "age", "extra"])
+
+    def test_compose__conflict_on_change(self):
+        from katashiro.exceptions import Conflict
+        x = self.manager.shortcut("x", ["a"])
+        y = self.manager.shortcut("y", ["b"])
+        xy = x + y
+        with self.assertRaises(Conflict):
+            self.manager._add_field(x, self.manager.Atom("b"))
+        self.assertEqual(x.declared, ["a"])
+        self.assertEqual(xy.declared, ["a", "b"])
+
+
+class FingerprintTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        self.manager = Manager(_Seq, _Domain, _Atom)
+
+    def test_equal_views(self):
+        x = self.manager.shortcut("person", ["name", "age", "birth"])
+        y = self.manager.shortcut("person", ["name", "age", "birth"])
+        self.assertTrue(self.manager.same(x.cut(["birth"]), y.only(["name", "age"])))
+        self.assertFalse(self.manager.same(x, x.rename(name="Name")))
+
+    def test_lambdas(self):
+        upper = self.manager.Atom("v", {"serialize": lambda v: v.upper()})
+        lower = self.manager.Atom("v", {"serialize": lambda v: v.lower()})
+        self.assertFalse(self.manager.same(upper, lower))
+
+    def test_callable_instance(self):
+        class Serializer(object):
+            def __call__(self, v):
+                return str(v)
+        with self.assertRaises(TypeError):
+            self.manager.fingerprint(self.manager.Atom("v", {"serialize": Serializer()}))
+        Serializer.__fingerprint__ = "serializer"
+        self.manager.fingerprint(self.manager.Atom("v", {"serialize": Serializer()}))
+
+    def test_invalidation(self):
+        person = self.manager.shortcut("person", ["name", ("address", ["tel"])])
+        fingerprint = self.manager.fingerprint(person)
+        self.manager.shortcut("other", ["x"])
+        person.cut(["name"])
+        self.assertEqual(person.__dict__.get("_fingerprint"), fingerprint)
+        self.manager._add_field(person.address, self.manager.Atom("zip"))
+        self.assertNotEqual(self.manager.fingerprint(person), fingerprint)
+
+    def _makeTranslator(self):
+        from katashiro.declarative import Translator
+        return Translator(self.manager)
+
+    def _declarePerson(self, translator, pet_fields):
+        Pet = translator.DomainMeta("Pet", (), {k: translator.Attribute() for k in pet_fields})
+        Person = translator.DomainMeta("Person", (), {"name": translator.Attribute(), "pets": translator.Seq("Pet")})
+        return Person, Pet
+
+    def test_alias__referenced_domain(self):
+        x, _ = self._declarePerson(self._makeTranslator(), ["name"])
+        y, _ = self._declarePerson(self._makeTranslator(), ["name", "kind"])
+        self.assertFalse(self.manager.same(x, y))
+
+    def test_alias__referenced_domain_changed(self):
+        person, pet = self._declarePerson(self._makeTranslator(), ["name"])
+        fingerprint = self.manager.fingerprint(person)
+        self.manager._add_field(pet, self.manager.Atom("kind"))
+        self.assertNotEqual(self.manager.fingerprint(person), fingerprint)
+        other, _ = self._declarePerson(self._makeTranslator(), ["name", "kind"])
+        self.assertEqual(self.manager.fingerprint(person.pets), self.manager.fingerprint(other.pets))
+
+    def test_alias__cycle(self):
+        translator = self._makeTranslator()
+        user = translator.DomainMeta("User", (), {"name": translator.Attribute(), "following": translator.Seq("User")})
+        fingerprint = self.manager.fingerprint(user)
+        self.assertEqual(self.manager.fingerprint(user), fingerprint)
+        self.manager._add_field(user, self.manager.Atom("email"))
+        self.assertNotEqual(self.manager.fingerprint(user), fingerprint)
+
+    def test_field_named_fingerprint(self):
+        from katashiro.wrapper import DomainMap
+
+        class Device(object):
+            name = "foo"
+            fingerprint = "ab:cd"
+        domain = self.manager.shortcut("device", ["name", "fingerprint"])
+        wrapper = DomainMap().lookup()(Device(), domain)
+        self.assertEqual(str(wrapper.fingerprint), "ab:cd")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+# -*- coding:utf-8 -*-
+import unittest
+
+
+class FootprintTests(unittest.TestCase):
+    def test_budgets(self):
+        from katashiro.footprint import run
+        footprints = {f.name: f for f in run(n=500)}
+        self.assertLess(footprints["record_batch"].size * 10, footprints["wrapped_sequence"].size)
+
+    def test_over_budget(self):
+        from katashiro.footprint import run, wrapped_sequence
+        from katashiro.exceptions import BudgetExceeded
+        with self.assertRaises(BudgetExceeded):
+            run(n=100, budgets={wrapped_sequence: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# -*- coding:utf-8 -*-
+import subprocess
+import sys
+import unittest
+
+
+def _run(code):
+    p = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return p.stdout.strip()
+
+
+class ImportTests(unittest.TestCase):
+    def test_deferred_modules(self):
+        from katashiro.footprint import imported_modules, deferred_modules
+        modules = set(imported_modules())
+        self.assertEqual([m for m in deferred_modules if m in modules], [])
+
+    def test_budget(self):
+        from katashiro.footprint import check_import
+        check_import()
+
+    def test_star_import(self):
+        code = "from katashiro import *; print(Domain, Atom, Seq, domain, Attribute, Sequence, DomainMeta, DomainMap)"
+        self.assertNotIn("module", _run(code))
+
+    def test_concurrent_access(self):
+        code = """
+import threading, katashiro
+names = ["Domain", "default_translator", "DomainMeta", "default_domain_manager"] * 4
+threads = [threading.Thread(target=getattr, args=(katashiro, name)) for name in names]
+for t in threads: t.start()
+for t in threads: t.join()
+manager = katashiro.default_domain_manager
+print(katashiro.Domain.__self__ is manager and katashiro.default_translator.manager is manager)
+"""
+        self.assertEqual(_run(code), "True")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding:utf-8 -*-
+import sqlite3
+import unittest
+
+
+class SelectTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        self.manager = Manager(_Seq, _Domain, _Atom)
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("create table pets (id integer, owner text, name text, species text)")
+        self.conn.execute("insert into pets values (1, 'foo', 'tama', 'cat')")
+
+    def _getTarget(self, domain):
+        from katashiro.plan import fetch_plan
+        return fetch_plan(domain)
+
+    def test_columns(self):
+        m = self.manager
+        domain = m.Domain("pet", [m.Atom("name"), m.Atom("kind", {"column": "species"})])
+        sql = self._getTarget(domain).select("pets")
+        self.assertEqual(sql, 'SELECT "name", "species" FROM "pets"')
+        self.assertEqual(self.conn.execute(sql).fetchall(), [("tama", "cat")])
+
+    def test_keys__nested(self):
+        m = self.manager
+        pet = m.Domain("pet", [m.Atom("name"), m.Atom("owner")])
+        domain = m.Domain("person", [m.Atom("name"), m.Seq("pets", [pet])])
+        sql = self._getTarget(domain).sequences["pets"].select("pets", keys=["id", "owner"])
+        self.assertEqual(sql, 'SELECT "id", "owner", "name" FROM "pets"')
+        self.assertEqual(self.conn.execute(sql).fetchall(), [(1, "foo", "tama")])
+
+    def test_no_columns(self):
+        m = self.manager
+        domain = m.Domain("person", [m.Seq("pets", [m.Domain("pet", [m.Atom("name")])])])
+        plan = self._getTarget(domain)
+        with self.assertRaises(ValueError):
+            plan.select("people")
+        self.assertEqual(plan.select("people", keys=["id"]), 'SELECT "id" FROM "people"')
+
+    def test_seq_of_atoms(self):
+        m = self.manager
+        domain = m.Domain("person", [m.Seq("tags", [m.Atom("tag", {"column": "label"})])])
+        plan = self._getTarget(domain)
+        self.assertEqual(plan.to_dict(), {"attributes": [], "columns": [],
+                                          "sequences": {"tags": {"attributes": ["tag"], "columns": ["label"]}}})
+        self.assertEqual(plan.sequences["tags"].select("tags", keys=["owner"]), 'SELECT "owner", "label" FROM "tags"')
+        self.assertEqual(self._getTarget(domain.tags).columns, ["label"])
+
+    def test_field_named_fetch_plan(self):
+        from katashiro.wrapper import DomainMap
+
+        class Report(object):
+            fetch_plan = "nightly"
+        domain = self.manager.shortcut("report", ["fetch_plan"])
+        self.assertEqual(self._getTarget(domain).columns, ["fetch_plan"])
+        self.assertEqual(str(DomainMap().lookup()(Report(), domain).fetch_plan), "nightly")
+
+
+if __name__ == "__main__":
+    unittest.main()
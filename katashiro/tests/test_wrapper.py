@@ -0,0 +1,388 @@
+# -*- coding:utf-8 -*-
+import sqlite3
+import unittest
+
+
+class Person(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Group(object):
+    def __init__(self, members):
+        self.members = members
+
+
+class PetStore(object):
+    """sqlite-backed stand-in for lazy relationships"""
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("create table pets (owner text, name text)")
+        self.queries = []
+
+    def add(self, owner, name):
+        self.conn.execute("insert into pets values (?, ?)", (owner, name))
+
+    def load(self, people):
+        names = [p.name for p in people]
+        self.queries.append(names)
+        sql = "select owner, name from pets where owner in ({}) order by name".format(", ".join("?" * len(names)))
+        pets = {}
+        for owner, name in self.conn.execute(sql, names):
+            pets.setdefault(owner, []).append(name)
+        return [", ".join(pets.get(name, [])) for name in names]
+
+
+class DomainMapTests(unittest.TestCase):
+    def _makeOne(self):
+        from katashiro.wrapper import DomainMap
+        return DomainMap()
+
+    def test_fall_through_to_parent(self):
+        target = self._makeOne()
+        target.add_scene("admin")
+        target.set("", "k", "base")
+        self.assertEqual(target.get("admin", "k"), "base")
+        with self.assertRaises(KeyError):
+            target.get("admin", "unknown")
+
+    def test_override(self):
+        target = self._makeOne()
+        target.add_scene("admin")
+        target.set("", "k", "base")
+        target.set("admin", "k", "admin")
+        self.assertEqual(target.get("admin", "k"), "admin")
+        self.assertEqual(target.get("", "k"), "base")
+
+    def test_flattened_cache__parent_set(self):
+        target = self._makeOne()
+        target.add_scene("admin")
+        target.add_scene("audit", parent="admin")
+        target.set("", "k", "old")
+        self.assertEqual(target.get("audit", "k"), "old")
+        target.set("", "k", "new")
+        self.assertNotIn("k", target.flattened["audit"])
+        self.assertEqual(target.get("audit", "k"), "new")
+
+    def test_reparent(self):
+        target = self._makeOne()
+        target.add_scene("admin")
+        target.add_scene("audit")
+        target.set("admin", "k", "admin")
+        target.set("audit", "k", "audit")
+        target.add_scene("x", parent="admin")
+        self.assertEqual(target.get("x", "k"), "admin")
+        target.add_scene("x", parent="audit")
+        self.assertEqual(target.get("x", "k"), "audit")
+        self.assertNotIn("x", target.children["admin"])
+        target.set("admin", "k", "admin2")
+        self.assertEqual(target.get("x", "k"), "audit")
+
+    def test_cycle(self):
+        target = self._makeOne()
+        target.add_scene("a")
+        target.add_scene("b", parent="a")
+        with self.assertRaises(ValueError):
+            target.add_scene("a", parent="b")
+        with self.assertRaises(ValueError):
+            target.add_scene("a", parent="a")
+        self.assertEqual(target.parents["a"], "")
+
+    def test_child_lookup_reuses_parent_entries(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        manager = Manager(_Seq, _Domain, _Atom)
+        domain = manager.shortcut("group", [("owner", ["name"])])
+        target = self._makeOne()
+        target.add_scene("admin")
+        group = Group([])
+        group.owner = Person("a")
+        self.assertEqual(str(target.lookup()(group, domain).owner.name), "a")
+        constructed = target.pool[""][(Group, "owner")]
+
+        lookup = target.lookup("admin")
+        lookup.construct = None  # must not be called
+        self.assertEqual(str(lookup(group, domain).owner.name), "a")
+        self.assertIs(target.get("admin", (Group, "owner")), constructed)
+        self.assertNotIn((Group, "owner"), target.pool["admin"])
+
+
+class BatchLoaderTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        from katashiro.wrapper import DomainMap
+        self.manager = Manager(_Seq, _Domain, _Atom)
+        self.store = PetStore()
+        self.store.add("a", "tama")
+        self.store.add("a", "pochi")
+        self.store.add("c", "mike")
+        self.person_domain = self.manager.Domain("person", [
+            self.manager.Atom("name"),
+            self.manager.Atom("pets", {"batch_loader": self.store.load}),
+        ])
+        self.group_domain = self.manager.Domain("group", [self.manager.Seq("members", [self.person_domain])])
+        self.lookup = DomainMap().lookup()
+
+    def _makeGroup(self, n):
+        return Group([Person(chr(ord("a") + i)) for i in range(n)])
+
+    def test_iteration__loaded_by_window(self):
+        self.lookup.batch_window = 2
+        wrapper = self.lookup(self._makeGroup(3), self.group_domain)
+        result = [(str(m.name), str(m.pets)) for m in wrapper.members]
+        self.assertEqual(result, [("a", "pochi, tama"), ("b", ""), ("c", "mike")])
+        self.assertEqual(self.store.queries, [["a", "b"], ["c"]])
+
+    def test_single_record__fallback(self):
+        wrapper = self.lookup(Person("a"), self.person_domain)
+        self.assertEqual(str(wrapper.pets), "pochi, tama")
+        self.assertEqual(self.store.queries, [["a"]])
+
+    def test_index_access__fallback(self):
+        wrapper = self.lookup(self._makeGroup(2), self.group_domain)
+        self.assertEqual(str(wrapper.members[0].pets), "pochi, tama")
+
+    def test_tracker(self):
+        tracker = self.lookup.track(self._makeGroup(1), self.group_domain)
+        self.assertEqual(tracker.render(), {"members[0].name": "a", "members[0].pets": "pochi, tama"})
+
+    def test_tracker__loaded_by_window(self):
+        self.lookup.batch_window = 2
+        group = self._makeGroup(5)
+        tracker = self.lookup.track(group, self.group_domain)
+        tracker.render()
+        self.store.add("b", "kuro")
+        self.assertEqual(tracker.diff(), {"members[1].pets": "kuro"})
+        windows = [["a", "b"], ["c", "d"], ["e"]]
+        self.assertEqual(self.store.queries, windows + windows)
+
+    def test_record_batch__loaded_at_once(self):
+        batch = self.lookup.batch(self._makeGroup(3).members, self.group_domain.members)
+        self.assertEqual([str(row.pets) for row in batch], ["pochi, tama", "", "mike"])
+        self.assertEqual(self.store.queries, [["a", "b", "c"]])
+
+    def test_wrong_length(self):
+        domain = self.manager.Domain("person", [self.manager.Atom("pets", {"batch_loader": lambda obs: []})])
+        with self.assertRaises(ValueError):
+            self.lookup(Person("a"), domain).pets
+
+
+class SeqOfAtomsTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        from katashiro.wrapper import DomainMap
+        self.manager = Manager(_Seq, _Domain, _Atom)
+        self.domain = self.manager.Domain("x", [self.manager.Seq("tags", [self.manager.Atom("tag")])])
+        self.lookup = DomainMap().lookup()
+
+    def test_iteration(self):
+        class X(object):
+            tags = ["a", "b"]
+        wrapper = self.lookup(X(), self.domain)
+        self.assertEqual([str(tag) for tag in wrapper.tags], ["a", "b"])
+
+    def test_record_batch(self):
+        batch = self.lookup.batch(["a", "b"], self.domain.tags)
+        self.assertEqual([str(tag) for tag in batch], ["a", "b"])
+
+    def test_prefetch(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        class X(object):
+            tags = ["a", "b"]
+        wrapper = self.lookup(X(), self.domain)
+        with ThreadPoolExecutor(2) as executor:
+            self.lookup.prefetch([wrapper] + list(wrapper.tags), executor=executor)
+        self.assertIn("tags", wrapper._children)
+        self.assertEqual([str(tag) for tag in wrapper.tags], ["a", "b"])
+
+
+class Profile(object):
+    """each getter waits for the others, so they must be called concurrently"""
+    def __init__(self, barrier):
+        self.barrier = barrier
+
+    @property
+    def name(self):
+        self.barrier.wait()
+        return "foo"
+
+    @property
+    def email(self):
+        self.barrier.wait()
+        return "foo@example.com"
+
+    @property
+    def broken(self):
+        raise KeyError("broken")
+
+
+class PrefetchTests(unittest.TestCase):
+    def setUp(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        from katashiro.wrapper import DomainMap
+        self.manager = Manager(_Seq, _Domain, _Atom)
+        self.domain = self.manager.shortcut("profile", ["name", "email"])
+        self.executor = ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.domain_map = DomainMap()
+
+    def test_concurrent(self):
+        import threading
+        wrapper = self.domain_map.lookup()(Profile(threading.Barrier(2, timeout=5)), self.domain)
+        self.domain_map.lookup().prefetch(wrapper, executor=self.executor)
+        self.assertEqual(sorted(wrapper._children), ["email", "name"])
+        self.assertEqual((str(wrapper.name), str(wrapper.email)), ("foo", "foo@example.com"))
+
+    def test_failed_field(self):
+        import threading
+        domain = self.manager.shortcut("profile", ["name", "broken"])
+        wrapper = self.domain_map.lookup()(Profile(threading.Barrier(1)), domain)
+        self.domain_map.lookup().prefetch(wrapper, executor=self.executor)
+        self.assertEqual(list(wrapper._children), ["name"])
+        with self.assertRaises(KeyError):
+            wrapper.broken
+
+    def test_seq_window_by_window(self):
+        import threading
+        lookup = self.domain_map.lookup(executor=self.executor)
+        lookup.batch_window = 2
+        domain = self.manager.Domain("group", [self.manager.Seq("members", [self.domain])])
+        members = [Profile(threading.Barrier(2, timeout=5)) for _ in range(3)]
+        seq_wrapper = lookup(Group(members), domain).members
+        prefetched = []
+        for _ in seq_wrapper:
+            wrappers = [seq_wrapper._children.get(m) for m in members]
+            prefetched.append([sorted(w._children) if w is not None else None for w in wrappers])
+        fields = ["email", "name"]
+        self.assertEqual(prefetched, [[fields, fields, None], [fields, fields, None], [fields, fields, fields]])
+
+    def test_default_executor__created_once(self):
+        import threading
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        from katashiro import wrapper
+        self.addCleanup(setattr, wrapper, "_default_executor", wrapper._default_executor)
+        wrapper._default_executor = None
+        created = []
+
+        def slow_executor(**kwargs):
+            time.sleep(0.05)
+            created.append(ThreadPoolExecutor(**kwargs))
+            self.addCleanup(created[-1].shutdown)
+            return created[-1]
+        with mock.patch("concurrent.futures.ThreadPoolExecutor", slow_executor):
+            threads = [threading.Thread(target=wrapper.default_executor) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(len(created), 1)
+        self.assertIs(wrapper.default_executor(), created[0])
+
+
+class TrackerTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        from katashiro.wrapper import DomainMap
+        manager = Manager(_Seq, _Domain, _Atom)
+        person_domain = manager.Domain("person", [manager.Atom("name"), manager.Atom("tags", {"serialize": ",".join})])
+        self.domain = manager.Domain("group", [
+            manager.Seq("members", [person_domain]),
+            manager.Seq("labels", [manager.Atom("label")]),
+        ])
+        self.lookup = DomainMap().lookup()
+
+    def _makeGroup(self, *names):
+        group = Group([Person(name) for name in names])
+        for p in group.members:
+            p.tags = ["x"]
+        group.labels = ["l"]
+        return group
+
+    def test_replaced_seq(self):
+        group = self._makeGroup("a")
+        tracker = self.lookup.track(group, self.domain)
+        tracker.render()
+        group.members = [Person("z"), Person("y")]
+        for p in group.members:
+            p.tags = []
+        tracker.render()
+        self.assertEqual(sorted(tracker.changed), ["members[0].name", "members[0].tags",
+                                                   "members[1].name", "members[1].tags"])
+        self.assertEqual([str(m.name) for m in tracker.wrapper.members], ["z", "y"])
+        self.assertEqual(len(tracker.wrapper.members._children), 2)
+
+    def test_mutable_leaf(self):
+        group = self._makeGroup("a")
+        tracker = self.lookup.track(group, self.domain)
+        tracker.render()
+        group.members[0].tags.append("y")
+        group.labels.append("m")
+        self.assertEqual(tracker.diff(), {"members[0].tags": "x,y", "labels[1]": "m"})
+        self.assertEqual(tracker.diff(), {})
+
+
+class MemoTests(unittest.TestCase):
+    def setUp(self):
+        from katashiro.domain import Manager, _Seq, _Domain, _Atom
+        from katashiro.wrapper import MemoRegistry, FieldWrapper
+        self.manager = Manager(_Seq, _Domain, _Atom)
+
+        class Wrapper(FieldWrapper):
+            memo_registry = MemoRegistry()
+        self.wrapper_factory = Wrapper
+
+    def test_hits(self):
+        calls = []
+
+        def serialize(v):
+            calls.append(v)
+            return str(v)
+        atom = self.manager.Atom("v", {"serialize": serialize, "memoize": 2})
+        result = [self.wrapper_factory(v, atom).serialize() for v in [1, True, 1, 1]]
+        self.assertEqual(result, ["1", "True", "1", "1"])
+        self.assertEqual(calls, [1, True])
+        self.assertEqual(self.wrapper_factory.memo_registry.info()[serialize.__qualname__]["hits"], 2)
+
+    def _serialize_all(self, fn, values):
+        atom = self.manager.Atom("v", {"serialize": fn, "memoize": True})
+        return [self.wrapper_factory(v, atom).serialize() for v in values]
+
+    def test_aware_datetime(self):
+        from datetime import datetime, timedelta, timezone
+        utc = datetime(2000, 1, 1, 12, tzinfo=timezone.utc)
+        jst = utc.astimezone(timezone(timedelta(hours=9), "JST"))
+        result = self._serialize_all(lambda v: v.strftime("%H:%M %Z"), [utc, jst, utc])
+        self.assertEqual(result, ["12:00 UTC", "21:00 JST", "12:00 UTC"])
+
+    def test_decimal(self):
+        from decimal import Decimal
+        result = self._serialize_all(str, [Decimal("1.0"), Decimal("1.00"), Decimal("-0"), Decimal("0")])
+        self.assertEqual(result, ["1.0", "1.00", "-0", "0"])
+
+    def test_float(self):
+        self.assertEqual(self._serialize_all(str, [0.0, -0.0, 1, 1.0]), ["0.0", "-0.0", "1", "1.0"])
+
+    def test_other_types__not_memoized(self):
+        calls = []
+
+        def serialize(v):
+            calls.append(v)
+            return repr(v)
+        self._serialize_all(serialize, [(1, 2), (1, 2)])
+        self.assertEqual(calls, [(1, 2), (1, 2)])
+
+    def test_released_with_function(self):
+        import gc
+        for i in range(10):
+            atom = self.manager.Atom("v", {"serialize": lambda v: v.upper(), "memoize": True})
+            self.wrapper_factory("x", atom).serialize()
+        del atom
+        gc.collect()
+        self.assertEqual(len(self.wrapper_factory.memo_registry), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,26 +1,138 @@
 # -*- coding:utf-8 -*-
 from katashiro import logger
-from katashiro.domain import S
+from katashiro.domain import S, Type
 from katashiro.lazylist import LazyList
-from collections import defaultdict
+from katashiro.langhelpers import lru_memo
+from collections import defaultdict, OrderedDict
+from threading import Lock
+from weakref import WeakKeyDictionary
+from array import array
+from copy import deepcopy
+from itertools import islice
+
+
+missing = object()
 
 
 class DomainMap(object):
     def __init__(self, lookup_factory=None):
         self.lookup_factory = Lookup
         self.pool = defaultdict(dict)
-
-    def lookup(self, scene=""):
-        return Lookup(self, scene=scene)
+        self.parents = {}
+        self.children = defaultdict(set)
+        self.flattened = defaultdict(dict)
+
+    def lookup(self, scene="", executor=None):
+        return Lookup(self, scene=scene, executor=executor)
+
+    def add_scene(self, scene, parent=""):
+        """scene inherits parent's entries, and stores only its own overrides"""
+        s = parent
+        while s is not None:
+            if s == scene:
+                raise ValueError("cyclic scene: {!r} (parent={!r})".format(scene, parent))
+            s = self.parents.get(s)
+        old = self.parents.get(scene)
+        if old is not None:
+            self.children[old].discard(scene)
+        self.parents[scene] = parent
+        self.children[parent].add(scene)
+        self.invalidate(scene)
 
     def get(self, scene, k):
-        return self.pool[scene][k]
+        cache = self.flattened[scene]
+        try:
+            return cache[k]
+        except KeyError:
+            s = scene
+            while s is not None:
+                v = self.pool[s].get(k, missing)
+                if v is not missing:
+                    cache[k] = v
+                    return v
+                s = self.parents.get(s)
+            raise KeyError(k)
 
     def set(self, scene, k, v):
         self.pool[scene][k] = v
+        self.invalidate(scene, k)
+
+    def invalidate(self, scene, k=missing):
+        if k is missing:
+            self.flattened.pop(scene, None)
+        else:
+            self.flattened[scene].pop(k, None)
+        for child in self.children.get(scene, ()):
+            self.invalidate(child, k)
+
+
+class MemoRegistry(object):
+    """memos of serialize/deserialize functions, shared by all lookups and scenes.
+
+    memos are released with their functions (weak references).
+    callables not supporting weak references (builtin methods) are kept up to static_maxsize, LRU.
+    """
+    default_maxsize = 256
+    static_maxsize = 128
+
+    def __init__(self):
+        self.memos = WeakKeyDictionary()  # fn -> {maxsize: memo}
+        self.static = OrderedDict()  # (fn, maxsize) -> memo
+        self.lock = Lock()
+
+    def get(self, fn, maxsize):
+        if maxsize is True:
+            maxsize = self.default_maxsize
+        with self.lock:
+            try:
+                memos = self.memos.get(fn)
+            except TypeError:
+                return self._get_static(fn, maxsize)
+            if memos is None:
+                memos = self.memos[fn] = {}
+            try:
+                return memos[maxsize]
+            except KeyError:
+                memo = memos[maxsize] = lru_memo(maxsize=maxsize)
+                return memo
+
+    def _get_static(self, fn, maxsize):
+        k = (fn, maxsize)
+        try:
+            self.static.move_to_end(k)
+            return self.static[k]
+        except KeyError:
+            memo = self.static[k] = lru_memo(maxsize=maxsize)
+            if len(self.static) > self.static_maxsize:
+                self.static.popitem(last=False)
+            return memo
+
+    def __len__(self):
+        return sum(len(memos) for memos in self.memos.values()) + len(self.static)
+
+    def info(self):
+        r = {}
+        items = [(fn, memo) for fn, memos in self.memos.items() for memo in memos.values()]
+        items.extend((fn, memo) for (fn, _), memo in self.static.items())
+        for fn, memo in items:
+            r[getattr(fn, "__qualname__", repr(fn))] = memo.info()
+        return r
+
+    def clear(self):
+        with self.lock:
+            for memos in self.memos.values():
+                for memo in memos.values():
+                    memo.clear()
+            for memo in self.static.values():
+                memo.clear()
+
+
+default_memo_registry = MemoRegistry()
 
 
 class Wrapper(object):
+    __slots__ = ()
+
     @property
     def metadata(self):
         return self.domain.metadata
@@ -33,6 +145,8 @@ class Wrapper(object):
 
 
 class FieldWrapper(Wrapper):
+    memo_registry = default_memo_registry
+
     def __init__(self, value, domain):
         self.value = value
         self.domain = domain
@@ -40,17 +154,23 @@ class FieldWrapper(Wrapper):
     def __str__(self):
         return self.serialize()
 
+    def _call(self, fn):
+        maxsize = self[S.memoize]
+        if not maxsize:
+            return fn(self.value)
+        return self.memo_registry.get(fn, maxsize).call(fn, self.value)
+
     def serialize(self):
         fn = self[S.serialize]
         if fn is not None:
-            return fn(self.value)
+            return self._call(fn)
         else:
             return str(self.value)
 
     def deserialize(self):
         fn = self[S.deserialize]
         if fn is not None:
-            return fn(self.value)
+            return self._call(fn)
         return self.value
 
     def __repr__(self):
@@ -76,7 +196,7 @@ class ModelWrapper(Wrapper):
             return self._children[attrname]
         except KeyError:
             subdomain = self.lookup.lookup(self.value, self.domain, attrname)
-            subvalue = getattr(self.value, attrname)
+            subvalue = self.lookup.resolve(self.value, subdomain, attrname)
             subwrapper = self.lookup.create_wrapper(subvalue, subdomain)
             self._children[attrname] = subwrapper
             return subwrapper
@@ -85,13 +205,30 @@ class ModelWrapper(Wrapper):
 class ModelSeqWrapper(Wrapper):
     def __init__(self, lookup, seq, domain):
         self.lookup = lookup
+        self.value = seq
         self.seq = LazyList(seq)
         self.domain = domain
         self._children = {}
 
     def __iter__(self):
-        for ob in self.seq:
-            yield self.get_child_wrapper(ob)
+        lookup = self.lookup
+        child_domain = self.domain.child_domain
+        loaders = lookup.batch_loaders(child_domain)
+        if child_domain.manager.is_atom(child_domain) or (not loaders and lookup.executor is None):
+            for ob in self.seq:
+                yield self.get_child_wrapper(ob)
+            return
+
+        it = iter(self.seq)
+        while True:
+            window = [self.get_child_wrapper(ob) for ob in islice(it, lookup.batch_window)]
+            if not window:
+                return
+            if loaders:
+                lookup.load_batch(window, loaders)
+            if lookup.executor is not None:
+                lookup.prefetch(window)
+            yield from window
 
     def __getitem__(self, k):
         if isinstance(k, int):
@@ -109,14 +246,259 @@ class ModelSeqWrapper(Wrapper):
             return subwrapper
 
 
+class RowWrapper(Wrapper):
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    @property
+    def domain(self):
+        return self.batch.domain.child_domain
+
+    def __getattr__(self, attrname):
+        batch = self.batch
+        try:
+            subdomain = batch.subdomains[attrname]
+        except KeyError:
+            raise AttributeError(attrname)
+        return batch.lookup.create_wrapper(batch.columns[attrname][self.index], subdomain)
+
+
+class RecordBatch(Wrapper):
+    """struct-of-arrays materialization of a seq domain.
+
+    each field is stored as a column (array for int atoms, list otherwise),
+    rows are transient views over the columns.
+    """
+    row_wrapper_factory = RowWrapper
+    int_typecode = "q"
+
+    def __init__(self, lookup, seq, domain):
+        self.lookup = lookup
+        self.domain = domain
+        self.subdomains = {}
+        self.columns = {}
+        child_domain = domain.child_domain
+        # seq of atoms, the values themselves are stored in a single column
+        self.atomic = child_domain.manager.is_atom(child_domain)
+        fields = [child_domain] if self.atomic else child_domain.fields
+        for f in fields:
+            if hasattr(f, "_swap"):
+                f = f._swap()
+            self.subdomains[f.id] = f
+            self.columns[f.id] = self.new_column(f)
+        self.length = 0
+        self.extend(seq)
+
+    def new_column(self, field):
+        if field.manager.is_atom(field) and field.metadata.get(S.datatype) == Type.int:
+            return array(self.int_typecode)
+        else:
+            return []
+
+    def extend(self, seq):
+        loaded = {}
+        if not self.atomic:
+            loaders = self.lookup.batch_loaders(self.domain.child_domain)
+            if loaders:
+                seq = list(seq)
+                for f in loaders:
+                    loaded[f.id] = iter(self.lookup.load_values(f, seq))
+        columns = list(self.columns.items())
+        for ob in seq:
+            for attrname, column in columns:
+                if self.atomic:
+                    value = ob
+                elif attrname in loaded:
+                    value = next(loaded[attrname])
+                else:
+                    value = getattr(ob, attrname)
+                try:
+                    column.append(value)
+                except (TypeError, OverflowError):
+                    # not fit in array. fallback to list
+                    column = self.columns[attrname] = list(column)
+                    column.append(value)
+                    columns = list(self.columns.items())
+            self.length += 1
+
+    def column(self, attrname):
+        return self.columns[attrname]
+
+    def row(self, i):
+        if self.atomic:
+            child_domain = self.domain.child_domain
+            return self.lookup.create_wrapper(self.columns[child_domain.id][i], child_domain)
+        return self.row_wrapper_factory(self, i)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self.row(i)
+
+    def __getitem__(self, k):
+        if isinstance(k, int):
+            if k < 0:
+                k += self.length
+            if not 0 <= k < self.length:
+                raise IndexError(k)
+            return self.row(k)
+        else:
+            return super(RecordBatch, self).__getitem__(k)
+
+
+class Tracker(object):
+    """remembering serialized leaf values, re-serializing only changed leaves on each render.
+
+    paths are declared paths, except that items of sequences are addressed by index (e.g. children[0].name).
+    leaf values are compared with deep copies taken at the previous render,
+    leaves that cannot be copied are re-serialized every time.
+    batch loaded fields of sequence items are loaded window by window, on each render.
+    """
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.snapshot = {}  # path -> (copy of value, serialized value)
+        self.changed = []
+
+    def render(self):
+        snapshot = {}
+        changed = []
+        self._walk(self.wrapper, "", snapshot, changed)
+        for path in self.snapshot:
+            if path not in snapshot:
+                changed.append(path)
+        self.snapshot = snapshot
+        self.changed = changed
+        return {path: pair[1] for path, pair in snapshot.items()}
+
+    def diff(self):
+        """changed leaves since the previous render (None, if removed)"""
+        self.render()
+        return {path: self.snapshot[path][1] if path in self.snapshot else None for path in self.changed}
+
+    def _walk(self, wrapper, prefix, snapshot, changed, loaded=None):
+        lookup = wrapper.lookup
+        for f in wrapper.domain.fields:
+            attrname = f.id
+            path = prefix + attrname
+            subdomain = lookup.lookup(wrapper.value, wrapper.domain, attrname)
+            if loaded is not None and attrname in loaded:
+                value = loaded[attrname]
+            else:
+                value = lookup.resolve(wrapper.value, subdomain, attrname)
+            if subdomain.manager.is_atom(subdomain) or value is None:
+                self._walk_leaf(wrapper, attrname, value, subdomain, path, snapshot, changed)
+                continue
+
+            child = wrapper._children.get(attrname)
+            if subdomain.manager.is_seq(subdomain):
+                items = list(value)
+                if child is None or child.value is not value or not self._same_items(child, items):
+                    # rebuilt, keeping the wrappers of remaining items
+                    new_child = wrapper._children[attrname] = lookup.create_wrapper(value, subdomain)
+                    if child is not None:
+                        for ob in items:
+                            if ob in child._children:
+                                new_child._children[ob] = child._children[ob]
+                    child = new_child
+                child_domain = subdomain.child_domain
+                loaded = self._load(lookup, child_domain, items)
+                for i, ob in enumerate(items):
+                    subwrapper = child.get_child_wrapper(ob)
+                    subpath = "{}[{}]".format(path, i)
+                    if child_domain.manager.is_atom(child_domain):
+                        self._walk_item(subwrapper, ob, subpath, snapshot, changed)
+                    else:
+                        self._walk(subwrapper, subpath + ".", snapshot, changed, loaded[i])
+            else:
+                if child is None or child.value is not value:
+                    child = wrapper._children[attrname] = lookup.create_wrapper(value, subdomain)
+                self._walk(child, path + ".", snapshot, changed)
+
+    def _load(self, lookup, child_domain, items):
+        """values of batch loaded fields of items ([{attrname: value}]), a loader call per window"""
+        loaded = [{} for _ in items]
+        for f in lookup.batch_loaders(child_domain):
+            for start in range(0, len(items), lookup.batch_window):
+                window = items[start:start + lookup.batch_window]
+                for d, value in zip(loaded[start:], lookup.load_values(f, window)):
+                    d[f.id] = value
+        return loaded
+
+    def _same_items(self, seq_wrapper, items):
+        seq = seq_wrapper.seq
+        if len(seq) != len(items):
+            return False
+        return all(seq[i] is ob for i, ob in enumerate(items))
+
+    def _unchanged(self, path, value, snapshot):
+        pair = self.snapshot.get(path)
+        if pair is None or pair[0] is missing:
+            return False
+        try:
+            # deepcopy() returns immutable values as is
+            unchanged = pair[0] is value or pair[0] == value
+        except Exception:
+            unchanged = False
+        if unchanged:
+            snapshot[path] = pair
+        return unchanged
+
+    def _freeze(self, value):
+        try:
+            return deepcopy(value)
+        except Exception:
+            return missing
+
+    def _walk_item(self, field_wrapper, value, path, snapshot, changed):
+        if self._unchanged(path, value, snapshot):
+            return
+        snapshot[path] = (self._freeze(value), field_wrapper.serialize())
+        changed.append(path)
+
+    def _walk_leaf(self, wrapper, attrname, value, subdomain, path, snapshot, changed):
+        if self._unchanged(path, value, snapshot):
+            return
+        if value is None:
+            wrapper._children.pop(attrname, None)
+            snapshot[path] = (None, None)
+        else:
+            child = wrapper._children.get(attrname)
+            if child is None or child.value is not value:
+                child = wrapper._children[attrname] = wrapper.lookup.create_wrapper(value, subdomain)
+            snapshot[path] = (self._freeze(value), child.serialize())
+        changed.append(path)
+
+
+_default_executor = None
+_default_executor_lock = Lock()
+
+
+def default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _default_executor = ThreadPoolExecutor(thread_name_prefix="katashiro")
+        return _default_executor
+
+
 class Lookup(object):
     wrapper_factory = ModelWrapper
     seq_wrapper_factory = ModelSeqWrapper
     field_wrapper_factory = FieldWrapper
+    batch_factory = RecordBatch
+    tracker_factory = Tracker
+    batch_window = 100
 
-    def __init__(self, domain_map, scene=""):
+    def __init__(self, domain_map, scene="", executor=None):
         self.domain_map = domain_map
         self.scene = scene
+        self.executor = executor  # if not None, sequences are prefetched window by window
 
     def create_wrapper(self, ob, domain):
         if domain.manager.is_atom(domain):
@@ -128,10 +510,41 @@ class Lookup(object):
 
     def lookup(self, ob, domain, attrname):
         k = (ob.__class__, attrname)
+        domain.manager.refresh(domain)
         try:
-            return self.domain_map.get(self.scene, k)
+            subdomain = self.domain_map.get(self.scene, k)
         except KeyError:
             return self.construct(ob, domain, attrname, k)
+        if "_retired" in subdomain.__dict__:
+            return self.construct(ob, domain, attrname, k)
+        return subdomain
+
+    def prefetch(self, wrappers, executor=None):
+        """resolve the fields of wrappers concurrently, filling their _children caches.
+
+        failed fields are left as is (raised again on attribute access).
+        wrappers other than ModelWrapper (e.g. items of a seq of atoms) have no fields, and are skipped.
+        """
+        if isinstance(wrappers, ModelWrapper):
+            wrappers = [wrappers]
+        executor = executor or self.executor or default_executor()
+        futures = []
+        for w in wrappers:
+            if not isinstance(w, ModelWrapper):
+                continue
+            for f in w.domain.fields:
+                if f.id in w._children or f.metadata.get(S.batch_loader) is not None:
+                    continue
+                futures.append((w, f.id, executor.submit(getattr, w.value, f.id)))
+        for w, attrname, future in futures:
+            try:
+                value = future.result()
+            except Exception as e:
+                logger.debug("prefetch failed: attrname=%s, %r", attrname, e)
+                continue
+            subdomain = self.lookup(w.value, w.domain, attrname)
+            w._children[attrname] = self.create_wrapper(value, subdomain)
+        return wrappers
 
     def construct(self, ob, domain, attrname, k):
         logger.debug("construct domain: attrname=%s", attrname)
@@ -149,6 +562,48 @@ class Lookup(object):
         self.domain_map.set(self.scene, (ob, None), domain)
         return ModelWrapper(self, ob, domain)
 
+    def track(self, ob, domain):
+        return self.tracker_factory(self(ob, domain))
+
+    def batch(self, seq, domain):
+        return self.batch_factory(self, seq, domain)
+
+    def batch_loaders(self, domain):
+        loaders = []
+        if domain.manager.is_atom(domain):
+            return loaders
+        for f in domain.fields:
+            if f.metadata.get(S.batch_loader) is not None:
+                loaders.append(f)
+        return loaders
+
+    def resolve(self, ob, domain, attrname):
+        """value of ob's attribute, via the batch loader of domain if declared"""
+        if domain.metadata.get(S.batch_loader) is None:
+            return getattr(ob, attrname)
+        return self.load_values(domain, [ob])[0]
+
+    def load_values(self, domain, obs):
+        values = list(domain.metadata[S.batch_loader](obs))
+        if len(values) != len(obs):
+            fmt = "batch loader of {}: {} values returned for {} objects"
+            raise ValueError(fmt.format(domain.id, len(values), len(obs)))
+        return values
+
+    def load_batch(self, wrappers, fields):
+        """resolve each field across wrappers with a single call of its batch loader.
+
+        a batch loader takes a list of source objects and returns their values in the same order.
+        """
+        for f in fields:
+            pending = [w for w in wrappers if f.id not in w._children]
+            if not pending:
+                continue
+            values = self.load_values(f, [w.value for w in pending])
+            for w, value in zip(pending, values):
+                subdomain = self.lookup(w.value, w.domain, f.id)
+                w._children[f.id] = self.create_wrapper(value, subdomain)
+
 
 if __name__ == "__main__":
     class Person(object):
@@ -185,3 +640,31 @@ if __name__ == "__main__":
     wrapper = lookup(family, familyDomain)
     for child in wrapper.children:
         print(child.name)
+
+    # batch loader (avoiding N+1 queries)
+    import sqlite3
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table pets (owner text, name text)")
+    conn.executemany("insert into pets values (?, ?)", [("a", "tama"), ("a", "pochi"), ("b", "mike")])
+
+    def load_pets(people):
+        names = [p.name for p in people]
+        print("query: {}".format(names))
+        sql = "select owner, name from pets where owner in ({})".format(", ".join("?" * len(names)))
+        pets = defaultdict(list)
+        for owner, name in conn.execute(sql, names):
+            pets[owner].append(name)
+        return [", ".join(pets[name]) for name in names]
+
+    PetOwnerDomain = PersonDomain + Atom("pets", {"batch_loader": load_pets})
+    family = Family(Person("foo", 20), Person("bar", 20), [Person("a", 1), Person("b", 2)])
+    wrapper = dm.lookup("pets")(family, Domain("family", [Seq("children", [PetOwnerDomain])]))
+    for child in wrapper.children:
+        print("{}: {}".format(child.name, child.pets))
+
+    # struct-of-arrays
+    PeopleDomain = Seq("people", [Domain("person") + Atom("name", {"doc": "Name"}) + Atom("age", {"datatype": "int"})])
+    batch = lookup.batch([Person("a", 1), Person("b", 2)], PeopleDomain)
+    print(batch.column("age"))
+    for row in batch:
+        print("{} - {}({})".format(row.name["doc"], row.name, row.age))